@@ -1,10 +1,13 @@
 import streamlit as st
 import pandas as pd
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_community.utilities import SQLDatabase
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.runnables import RunnableLambda
+from langchain_core.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 import os
 
@@ -18,207 +21,319 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def init_llm_cache():
+    """Enable LangChain's global LLM cache so repeated prompts skip the API"""
+    set_llm_cache(SQLiteCache(database_path=".langchain.db"))
+
+init_llm_cache()
+
+# System prompts; the schema is appended when the chains are built
+SQL_SYSTEM = ("Given an input question, convert it to a SQL query. No pre-amble. "
+              "Please do not return anything else apart from the SQL query, no prefix or suffix quotes, no sql keyword, nothing please. "
+              "Based on the table schema below, write a SQL query that would answer the user's question:\n")
+NL_SYSTEM = ("Given an input question and SQL response, convert it to a natural language answer. No pre-amble. "
+             "Based on the table schema below, question, sql query, and sql response, write a natural language response:\n")
+
+def build_sql_messages(system, question):
+    """Build the SQL-generation messages with an f-string (no template engine)"""
+    return [system, HumanMessage(content=f"Question: {question}\nSQL Query:")]
+
+def build_nl_messages(system, question, query, response):
+    """Build the answer messages with an f-string (no template engine)"""
+    return [system, HumanMessage(content=f"Question: {question}\nSQL Query: {query}\nSQL Response: {response}")]
+
+MAX_RESULT_ROWS = 50
+
+SAMPLE_QUERIES = [
+    "Give me the name of 10 Artists",
+    "Give me the name and artist ID of 10 Artists", 
+    "Give me 10 Albums by the Artist with ID 1",
+    "Give some Albums by the Artist name Audioslave",
+    "Give some Tracks by the Artist name Audioslave"
+]
+
+DB_URI = "sqlite:///file:Chinook.db?mode=ro&uri=true"
+
+SQL_MODEL = "gemini-2.0-flash-lite"
+ANSWER_MODEL = "gemini-2.5-flash"
+
+# Hash the db/llm arguments by URI and model name
+HASH_FUNCS = {
+    SQLDatabase: lambda db: db._engine.url.render_as_string(hide_password=False),
+    "langchain_google_genai.chat_models.ChatGoogleGenerativeAI": lambda llm: llm.model,
+}
+
 # Initialize session state
 if 'query_history' not in st.session_state:
     st.session_state.query_history = []
+if 'query_input' not in st.session_state:
+    st.session_state.query_input = ""
 
-@st.cache_resource
-def init_database():
-    """Initialize database connection"""
-    try:
-        db = SQLDatabase.from_uri("sqlite:///Chinook.db", sample_rows_in_table_info=0)
-        return db
-    except Exception as e:
-        st.error(f"Error connecting to database: {e}")
-        return None
+@st.cache_resource(max_entries=4)
+def init_database(uri=DB_URI):
+    """Initialize database connection (errors propagate so a failure is retried, not cached)"""
+    connect_args = {"check_same_thread": False} if uri.startswith("sqlite") else {}
+    engine = create_engine(
+        uri,
+        poolclass=QueuePool,
+        pool_size=8,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+    return SQLDatabase(engine, sample_rows_in_table_info=0)
 
-@st.cache_resource
-def get_llm():
-    """Initialize the LLM"""
-    try:
-        return ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.0)
-    except Exception as e:
-        st.error(f"Error initializing LLM: {e}")
-        return None
+@st.cache_resource(max_entries=4)
+def get_llm(model=ANSWER_MODEL):
+    """Initialize the LLM (errors propagate so a failure is retried, not cached)"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, temperature=0.0)
 
+@st.cache_data(max_entries=4, hash_funcs=HASH_FUNCS)
 def get_schema(db):
-    """Get database schema"""
+    """Get database schema (cached per database URI)"""
     if db:
         return db.get_table_info()
     return "Database not connected"
 
-def run_query(db, query):
-    """Execute SQL query"""
+@st.cache_data(ttl="10m", max_entries=256, hash_funcs=HASH_FUNCS)
+def run_sql(query, db, limit=MAX_RESULT_ROWS):
+    """Execute a read-only SQL query and return (columns, rows, total)"""
+    with db._engine.connect() as conn:
+        cursor = conn.execute(text(query))
+        if not cursor.returns_rows:
+            raise ValueError("Only queries that return rows are supported")
+        columns = list(cursor.keys())
+        rows = [tuple(row) for row in cursor.fetchmany(limit)]
+        total = len(rows) + sum(1 for _ in cursor)
+    return columns, rows, total
+
+def run_query_rows(db, query, limit=MAX_RESULT_ROWS):
+    """Execute SQL query and return ((columns, rows, total), error), keeping at most `limit` rows"""
     if db:
         try:
-            result = db.run(query)
-            return result, None
+            return run_sql(query.strip(), db, limit), None
         except Exception as e:
             return None, str(e)
     return None, "Database not connected"
 
-def write_sql_query(llm, db):
-    """Create SQL query generation chain"""
-    template = """Based on the table schema below, write a SQL query that would answer the user's question:
-    {schema}
-
-    Question: {question}
-    SQL Query:"""
+def format_rows(columns, rows):
+    """Render query rows compactly for the natural language prompt"""
+    lines = [" | ".join(columns)]
+    lines += [" | ".join(str(value) for value in row) for row in rows]
+    return "\n".join(lines)
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Given an input question, convert it to a SQL query. No pre-amble. "
-         "Please do not return anything else apart from the SQL query, no prefix or suffix quotes, no sql keyword, nothing please"),
-        ("human", template),
-    ])
+def describe_rows(shown, total):
+    """Row count note shown under the results table"""
+    if shown < total:
+        return f"Showing first {shown} of {total} rows"
+    return f"{total} rows"
 
-    def generate_sql(inputs):
-        # Add schema to inputs
-        inputs_with_schema = {**inputs, "schema": get_schema(db)}
-        # Format prompt
-        formatted_prompt = prompt.format_messages(**inputs_with_schema)
-        # Get response from LLM
-        response = llm.invoke(formatted_prompt)
-        # Parse output
-        return response.content.strip()
-    
-    return generate_sql
-
-def answer_user_query(query, llm, db):
-    """Generate natural language answer"""
-    template = """Based on the table schema below, question, sql query, and sql response, write a natural language response:
-    {schema}
+def truncate_rows(columns, rows, total, max_rows=20, max_chars=2000):
+    """Render at most `max_rows` rows and `max_chars` characters for the answer prompt"""
+    shown = rows[:max_rows]
+    rendered = format_rows(columns, shown)
+    if len(rendered) > max_chars:
+        rendered = rendered[:max_chars] + "\n..."
+    if total > len(shown):
+        rendered += f"\n...{total - len(shown)} more rows"
+    rendered += f"\n({total} rows in total)"
+    return rendered
 
-    Question: {question}
-    SQL Query: {query}
-    SQL Response: {response}"""
+@st.cache_resource(max_entries=4, hash_funcs=HASH_FUNCS)
+def build_chains(llm, db):
+    """Compose the SQL-generation and answer chains with the schema bound in"""
+    schema = get_schema(db)
+    sql_system = SystemMessage(content=SQL_SYSTEM + schema)
+    nl_system = SystemMessage(content=NL_SYSTEM + schema)
+    sql_chain = (
+        RunnableLambda(lambda inputs: build_sql_messages(sql_system, **inputs))
+        | llm
+        | StrOutputParser()
+    )
+    nl_chain = (
+        RunnableLambda(lambda inputs: build_nl_messages(nl_system, **inputs))
+        | llm
+        | StrOutputParser()
+    )
+    return sql_chain, nl_chain
 
-    prompt_response = ChatPromptTemplate.from_messages([
-        ("system", "Given an input question and SQL response, convert it to a natural language answer. No pre-amble."),
-        ("human", template),
-    ])
+@st.cache_resource(max_entries=4, hash_funcs=HASH_FUNCS)
+def precompute_sample_sql(sql_llm, db):
+    """Generate SQL for the sample questions once (temperature 0 makes it deterministic)"""
+    sql_chain, _ = build_chains(sql_llm, db)
+    inputs = [{"question": question} for question in SAMPLE_QUERIES]
+    results = sql_chain.batch(inputs, return_exceptions=True)
+    # Raise so a partial result is never cached; successes are in the LLM cache
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return {q: sql.strip() for q, sql in zip(SAMPLE_QUERIES, results)}
 
-    sql_generator = write_sql_query(llm, db)
+def answer_user_query(query, llm, sql_llm, db):
+    """Generate natural language answer; returns a dict of sql, columns, rows, total and answer stream"""
+    sql_chain, _ = build_chains(sql_llm, db)
+    fallback_sql_chain, nl_chain = build_chains(llm, db)
+    try:
+        sample_sql = precompute_sample_sql(sql_llm, db)
+    except Exception:
+        sample_sql = {}
     
-    # Generate SQL query
-    sql_result = sql_generator({"question": query})
+    # Generate SQL query, reusing the precomputed SQL for sample questions
+    sql_result, db_result, error = None, None, None
+    if query in sample_sql:
+        sql_result = sample_sql[query]
+    else:
+        try:
+            sql_result = sql_chain.invoke({"question": query}).strip()
+        except Exception as e:
+            error = str(e)
     
     # Execute SQL query
-    db_result, error = run_query(db, sql_result)
+    if sql_result is not None:
+        db_result, error = run_query_rows(db, sql_result)
+    
+    if error:
+        # Retry with the stronger model if the cheap model failed or its SQL didn't run
+        sql_result = fallback_sql_chain.invoke({"question": query}).strip()
+        db_result, error = run_query_rows(db, sql_result)
     
     if error:
         raise Exception(f"SQL Error: {error}")
+    columns, rows, total = db_result
     
     # Prepare inputs for natural language response
     response_inputs = {
         "question": query,
         "query": sql_result,
-        "schema": get_schema(db),
-        "response": db_result
+        "response": truncate_rows(columns, rows, total)
     }
     
-    # Generate natural language response
-    formatted_prompt = prompt_response.format_messages(**response_inputs)
-    response = llm.invoke(formatted_prompt)
+    # Stream the natural language response
+    response = nl_chain.stream(response_inputs)
     
-    return response
+    return {"sql": sql_result, "columns": columns, "rows": rows, "total": total, "answer": response}
+
+@st.fragment
+def render_sidebar(db):
+    """Sidebar schema viewer; its widgets rerun only this fragment"""
+    st.header("📋 Database Schema")
+    if st.button("Show Schema"):
+        with st.expander("Database Tables", expanded=True):
+            schema = get_schema(db)
+            st.text(schema)
+
+def select_history_query(query):
+    """Button callback: load a previous question into the question box"""
+    st.session_state.query_input = query
+
+def clear_history():
+    """Button callback: forget all previous questions"""
+    st.session_state.query_history = []
+
+@st.fragment
+def render_query_area(llm, sql_llm, db):
+    """Question input, samples, results and history; its widgets rerun only this fragment"""
+    st.header("💬 Ask Your Question")
+    
+    # Query input
+    query_input = st.text_area(
+        "Enter your question:",
+        placeholder="e.g., Give some Tracks by the Artist name Audioslave",
+        height=100,
+        key="query_input"
+    )
+    
+    # Sample questions
+    st.subheader("📝 Sample Questions")
+    selected_sample = st.selectbox("Or choose a sample question:", [""] + SAMPLE_QUERIES)
+    
+    if selected_sample:
+        query_input = selected_sample
+    
+    # Execute button
+    if st.button("🚀 Execute Query", type="primary", disabled=not query_input.strip()):
+        if query_input.strip():
+            with st.spinner("Processing your question..."):
+                try:
+                    # Generate SQL, run it and get answer in a single pass
+                    result = answer_user_query(query_input, llm, sql_llm, db)
+                    generated_sql = result["sql"]
+                    
+                    # Display results
+                    st.success("Query executed successfully!")
+                    
+                    # Natural language answer, streamed as it is generated
+                    st.subheader("📖 Answer")
+                    response = st.write_stream(result["answer"])
+                    
+                    # Store in history
+                    st.session_state.query_history.append((query_input, response))
+                    
+                    # Show generated SQL
+                    with st.expander("🔍 Generated SQL Query", expanded=False):
+                        st.code(generated_sql, language="sql")
+                    
+                    # Show raw results
+                    with st.expander("📊 Raw Results", expanded=False):
+                        if result["rows"]:
+                            st.dataframe(pd.DataFrame(result["rows"], columns=result["columns"]))
+                            st.caption(describe_rows(len(result["rows"]), result["total"]))
+                        else:
+                            st.write("No results returned")
+                
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
+    
+    # Rendered last so a query executed above is already listed
+    st.subheader("🕒 Query History")
+    if st.session_state.query_history:
+        for i, (q, _) in enumerate(reversed(st.session_state.query_history[-5:])):
+            st.button(
+                f"Query {len(st.session_state.query_history)-i}",
+                key=f"history_{i}",
+                on_click=select_history_query,
+                args=(q,)
+            )
+    
+    st.button("Clear History", on_click=clear_history)
 
 def main():
     st.title("🗄️ Text-to-SQL Assistant")
     st.markdown("Ask questions about your database in natural language!")
     
     # Initialize components
-    db = init_database()
-    llm = get_llm()
+    try:
+        db = init_database()
+    except Exception as e:
+        st.error(f"Error connecting to database: {e}")
+        db = None
+    try:
+        llm = get_llm()
+        sql_llm = get_llm(SQL_MODEL)
+    except Exception as e:
+        st.error(f"Error initializing LLM: {e}")
+        llm = sql_llm = None
     
     if not db or not llm:
         st.error("Failed to initialize application. Please check your configuration.")
         return
     
+    with st.spinner("Preparing sample questions..."):
+        try:
+            precompute_sample_sql(sql_llm, db)
+        except Exception as e:
+            st.warning(f"Could not prepare sample questions: {e}")
+    
     # Sidebar
     with st.sidebar:
-        st.header("📋 Database Schema")
-        if st.button("Show Schema"):
-            with st.expander("Database Tables", expanded=True):
-                schema = get_schema(db)
-                st.text(schema)
-        
-        st.header("🕒 Query History")
-        if st.session_state.query_history:
-            for i, (q, _) in enumerate(reversed(st.session_state.query_history[-5:])):
-                if st.button(f"Query {len(st.session_state.query_history)-i}", key=f"history_{i}"):
-                    st.session_state.selected_query = q
-        
-        if st.button("Clear History"):
-            st.session_state.query_history = []
-            st.rerun()
+        render_sidebar(db)
     
     # Main content
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        st.header("💬 Ask Your Question")
-        
-        # Query input
-        query_input = st.text_area(
-            "Enter your question:",
-            placeholder="e.g., Give some Tracks by the Artist name Audioslave",
-            height=100,
-            value=st.session_state.get('selected_query', '')
-        )
-        
-        # Sample questions
-        st.subheader("📝 Sample Questions")
-        sample_queries = [
-            "Give me the name of 10 Artists",
-            "Give me the name and artist ID of 10 Artists", 
-            "Give me 10 Albums by the Artist with ID 1",
-            "Give some Albums by the Artist name Audioslave",
-            "Give some Tracks by the Artist name Audioslave"
-        ]
-        
-        selected_sample = st.selectbox("Or choose a sample question:", [""] + sample_queries)
-        
-        if selected_sample:
-            query_input = selected_sample
-        
-        # Execute button
-        if st.button("🚀 Execute Query", type="primary", disabled=not query_input.strip()):
-            if query_input.strip():
-                with st.spinner("Processing your question..."):
-                    try:
-                        # Generate SQL and get answer
-                        response = answer_user_query(query_input, llm, db)
-                        
-                        # Get the SQL query for display
-                        sql_generator = write_sql_query(llm, db)
-                        generated_sql = sql_generator({"question": query_input})
-                        
-                        # Execute SQL to get raw results
-                        raw_results, sql_error = run_query(db, generated_sql)
-                        
-                        # Store in history
-                        st.session_state.query_history.append((query_input, response.content))
-                        
-                        # Display results
-                        st.success("Query executed successfully!")
-                        
-                        # Natural language answer
-                        st.subheader("📖 Answer")
-                        st.write(response.content)
-                        
-                        # Show generated SQL
-                        with st.expander("🔍 Generated SQL Query", expanded=False):
-                            st.code(generated_sql, language="sql")
-                        
-                        # Show raw results
-                        with st.expander("📊 Raw Results", expanded=False):
-                            if raw_results:
-                                st.text(raw_results)
-                            else:
-                                st.write("No results returned")
-                        
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
+        render_query_area(llm, sql_llm, db)
     
     with col2:
         st.header("ℹ️ Information")
@@ -236,7 +351,7 @@ def main():
         """)
         
         st.header("🔧 Configuration")
-        st.write(f"**Model:** Gemini 2.5 Flash")
+        st.write(f"**Model:** Gemini 2.0 Flash-Lite (SQL), Gemini 2.5 Flash (answers)")
         st.write(f"**Database:** Chinook SQLite")
         
         # API Key status
@@ -1,101 +1,216 @@
 import gradio as gr
-from langchain_core.prompts import ChatPromptTemplate
+import pandas as pd
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_community.utilities import SQLDatabase
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.runnables import RunnableLambda
+from langchain_core.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
+import asyncio
+import collections
+import functools
 import os
+import threading
 
 # Load environment
 load_dotenv()
 
-# Initialize database and LLM
-db = SQLDatabase.from_uri("sqlite:///Chinook.db", sample_rows_in_table_info=0)
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.0)
+# Cache LLM responses so repeated prompts skip the API
+set_llm_cache(SQLiteCache(database_path=".langchain.db"))
 
+# Initialize database engine; the database wrapper and LLM are created lazily
+engine = create_engine(
+    "sqlite:///file:Chinook.db?mode=ro&uri=true",
+    poolclass=QueuePool,
+    pool_size=8,
+    pool_pre_ping=True,
+    connect_args={"check_same_thread": False},
+)
+
+@functools.lru_cache(maxsize=1)
+def get_db():
+    """Initialize the database wrapper on first use (failures are retried, not cached)"""
+    return SQLDatabase(engine, sample_rows_in_table_info=0)
+
+SQL_MODEL = "gemini-2.0-flash-lite"
+ANSWER_MODEL = "gemini-2.5-flash"
+
+@functools.lru_cache(maxsize=2)
+def get_llm(model=ANSWER_MODEL):
+    """Initialize the LLM on first use (failures are retried, not cached)"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, temperature=0.0)
+
+MAX_RESULT_ROWS = 50
+
+# System prompts; the schema is appended when the chains are built
+SQL_SYSTEM = ("Given an input question, convert it to a SQL query. No pre-amble. "
+              "Please do not return anything else apart from the SQL query, no prefix or suffix quotes, no sql keyword, nothing please. "
+              "Based on the table schema below, write a SQL query that would answer the user's question:\n")
+NL_SYSTEM = ("Given an input question and SQL response, convert it to a natural language answer. No pre-amble. "
+             "Based on the table schema below, question, sql query, and sql response, write a natural language response:\n")
+
+def build_sql_messages(system, question):
+    """Build the SQL-generation messages with an f-string (no template engine)"""
+    return [system, HumanMessage(content=f"Question: {question}\nSQL Query:")]
+
+def build_nl_messages(system, question, query, response):
+    """Build the answer messages with an f-string (no template engine)"""
+    return [system, HumanMessage(content=f"Question: {question}\nSQL Query: {query}\nSQL Response: {response}")]
+
+@functools.lru_cache(maxsize=2)
+def get_chains(model=ANSWER_MODEL):
+    """Compose the SQL-generation and answer chains with the schema bound in"""
+    llm = get_llm(model)
+    schema = get_schema()
+    sql_system = SystemMessage(content=SQL_SYSTEM + schema)
+    nl_system = SystemMessage(content=NL_SYSTEM + schema)
+    sql_chain = (
+        RunnableLambda(lambda inputs: build_sql_messages(sql_system, **inputs))
+        | llm
+        | StrOutputParser()
+    )
+    nl_chain = (
+        RunnableLambda(lambda inputs: build_nl_messages(nl_system, **inputs))
+        | llm
+        | StrOutputParser()
+    )
+    return sql_chain, nl_chain
+
+@functools.lru_cache(maxsize=1)
 def get_schema():
-    """Get database schema"""
-    return db.get_table_info()
+    """Get database schema (cached for the lifetime of the process)"""
+    return get_db().get_table_info()
+
+# LRU cache of SQL results keyed by (sql, limit)
+SQL_CACHE_SIZE = 256
+sql_cache = collections.OrderedDict()
+sql_cache_lock = threading.Lock()
 
-def run_query(query):
-    """Execute SQL query"""
+def run_sql(query, limit=MAX_RESULT_ROWS):
+    """Execute a read-only SQL query and return (columns, rows, total)"""
+    with engine.connect() as conn:
+        cursor = conn.execute(text(query))
+        if not cursor.returns_rows:
+            raise ValueError("Only queries that return rows are supported")
+        columns = list(cursor.keys())
+        rows = [tuple(row) for row in cursor.fetchmany(limit)]
+        total = len(rows) + sum(1 for _ in cursor)
+    return columns, rows, total
+
+def run_query_rows(query, limit=MAX_RESULT_ROWS):
+    """Execute SQL query and return ((columns, rows, total), error), keeping at most `limit` rows"""
+    query = query.strip()
+    key = (query, limit)
+    with sql_cache_lock:
+        if key in sql_cache:
+            sql_cache.move_to_end(key)
+            return sql_cache[key], None
     try:
-        result = db.run(query)
-        return result, None
+        result = run_sql(query, limit)
     except Exception as e:
+        # Errors are returned but never cached
         return None, str(e)
+    with sql_cache_lock:
+        sql_cache[key] = result
+        if len(sql_cache) > SQL_CACHE_SIZE:
+            sql_cache.popitem(last=False)
+    return result, None
 
-def write_sql_query():
-    """Create SQL query generation chain"""
-    template = """Based on the table schema below, write a SQL query that would answer the user's question:
-    {schema}
-
-    Question: {question}
-    SQL Query:"""
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "Given an input question, convert it to a SQL query. No pre-amble. "
-         "Please do not return anything else apart from the SQL query, no prefix or suffix quotes, no sql keyword, nothing please"),
-        ("human", template),
-    ])
-
-    def generate_sql(inputs):
-        # Add schema to inputs
-        inputs_with_schema = {**inputs, "schema": get_schema()}
-        # Format prompt
-        formatted_prompt = prompt.format_messages(**inputs_with_schema)
-        # Get response from LLM
-        response = llm.invoke(formatted_prompt)
-        # Parse output
-        return response.content.strip()
-    
-    return generate_sql
+def format_rows(columns, rows):
+    """Render query rows compactly for the natural language prompt"""
+    lines = [" | ".join(columns)]
+    lines += [" | ".join(str(value) for value in row) for row in rows]
+    return "\n".join(lines)
+
+def describe_rows(shown, total):
+    """Row count note shown under the results table"""
+    if shown < total:
+        return f"Showing first {shown} of {total} rows"
+    return f"{total} rows"
 
-def process_query(question):
-    """Process natural language question and return results"""
+def truncate_rows(columns, rows, total, max_rows=20, max_chars=2000):
+    """Render at most `max_rows` rows and `max_chars` characters for the answer prompt"""
+    shown = rows[:max_rows]
+    rendered = format_rows(columns, shown)
+    if len(rendered) > max_chars:
+        rendered = rendered[:max_chars] + "\n..."
+    if total > len(shown):
+        rendered += f"\n...{total - len(shown)} more rows"
+    rendered += f"\n({total} rows in total)"
+    return rendered
+
+async def process_query(question):
+    """Process natural language question and stream back results"""
     if not question.strip():
-        return "Please enter a question.", "", ""
+        yield "Please enter a question.", "", None, ""
+        return
     
     try:
-        # Generate SQL query
-        sql_generator = write_sql_query()
-        generated_sql = sql_generator({"question": question})
+        # First use builds the chains and samples, so keep it off the event loop
+        sql_chain, _ = await asyncio.to_thread(get_chains, SQL_MODEL)
+        fallback_sql_chain, nl_chain = await asyncio.to_thread(get_chains)
+        try:
+            sample_sql = await asyncio.to_thread(get_sample_sql)
+        except Exception:
+            sample_sql = {}
+        
+        # Generate SQL query, reusing the precomputed SQL for sample questions
+        generated_sql, db_result, sql_error = None, None, None
+        if question in sample_sql:
+            generated_sql = sample_sql[question]
+        else:
+            try:
+                generated_sql = (await sql_chain.ainvoke({"question": question})).strip()
+            except Exception as e:
+                sql_error = str(e)
         
-        # Execute SQL query
-        raw_results, sql_error = run_query(generated_sql)
+        # Execute SQL query off the event loop so other users aren't blocked
+        if generated_sql is not None:
+            db_result, sql_error = await asyncio.to_thread(run_query_rows, generated_sql)
         
         if sql_error:
-            return f"SQL Error: {sql_error}", generated_sql, ""
+            # Retry with the stronger model if the cheap model failed or its SQL didn't run
+            generated_sql = (await fallback_sql_chain.ainvoke({"question": question})).strip()
+            db_result, sql_error = await asyncio.to_thread(run_query_rows, generated_sql)
+        
+        if sql_error:
+            yield f"SQL Error: {sql_error}", generated_sql, None, ""
+            return
+        columns, rows, total = db_result
+        raw_results = pd.DataFrame(rows, columns=columns)
+        rows_note = describe_rows(len(rows), total)
         
-        # Generate natural language response
-        template = """Based on the table schema below, question, sql query, and sql response, write a natural language response:
-        {schema}
-
-        Question: {question}
-        SQL Query: {query}
-        SQL Response: {response}"""
-
-        prompt_response = ChatPromptTemplate.from_messages([
-            ("system", "Given an input question and SQL response, convert it to a natural language answer. No pre-amble."),
-            ("human", template),
-        ])
-
         # Generate natural language response
         response_inputs = {
             "question": question,
             "query": generated_sql,
-            "schema": get_schema(),
-            "response": raw_results
+            "response": truncate_rows(columns, rows, total)
         }
         
-        formatted_prompt = prompt_response.format_messages(**response_inputs)
-        natural_response = llm.invoke(formatted_prompt)
-        
-        return natural_response.content, generated_sql, str(raw_results)
+        # Send the SQL and table once, then stream only the answer
+        yield "", generated_sql, raw_results, rows_note
+        answer = ""
+        async for chunk in nl_chain.astream(response_inputs):
+            answer += chunk
+            yield answer, gr.update(), gr.update(), gr.update()
         
     except Exception as e:
-        return f"Error: {str(e)}", "", ""
+        yield f"Error: {str(e)}", "", None, ""
+
+def precompute_sample_sql(questions):
+    """Generate SQL for the sample questions once (temperature 0 makes it deterministic)"""
+    sql_chain, _ = get_chains(SQL_MODEL)
+    inputs = [{"question": question} for question in questions]
+    results = sql_chain.batch(inputs, return_exceptions=True)
+    # Raise so a partial result is never cached; successes are in the LLM cache
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return {q: sql.strip() for q, sql in zip(questions, results)}
 
 def show_schema():
     """Return database schema"""
@@ -113,6 +228,11 @@ sample_queries = [
     "List all genres in the database"
 ]
 
+@functools.lru_cache(maxsize=1)
+def get_sample_sql():
+    """Precomputed {question: sql} for the sample questions, built on first use"""
+    return precompute_sample_sql(sample_queries)
+
 # Create Gradio interface
 with gr.Blocks(title="Text-to-SQL Assistant", theme=gr.themes.Soft()) as demo:
     gr.Markdown("# 🗄️ Text-to-SQL Assistant")
@@ -159,11 +279,11 @@ with gr.Blocks(title="Text-to-SQL Assistant", theme=gr.themes.Soft()) as demo:
                 )
             
             with gr.Accordion("📊 Raw Database Results", open=False):
-                raw_output = gr.Textbox(
+                raw_output = gr.Dataframe(
                     label="Raw Results",
-                    lines=6,
                     interactive=False
                 )
+                rows_output = gr.Markdown()
         
         with gr.Column(scale=1):
             gr.Markdown("## ℹ️ Information")
@@ -181,7 +301,7 @@ with gr.Blocks(title="Text-to-SQL Assistant", theme=gr.themes.Soft()) as demo:
             """)
             
             gr.Markdown("## 🔧 Configuration")
-            gr.Markdown("**Model:** Gemini 2.5 Flash")
+            gr.Markdown("**Model:** Gemini 2.0 Flash-Lite (SQL), Gemini 2.5 Flash (answers)")
             gr.Markdown("**Database:** Chinook SQLite")
             
             # API Key status
@@ -211,19 +331,29 @@ with gr.Blocks(title="Text-to-SQL Assistant", theme=gr.themes.Soft()) as demo:
     submit_btn.click(
         process_query,
         inputs=[question_input],
-        outputs=[answer_output, sql_output, raw_output]
+        outputs=[answer_output, sql_output, raw_output, rows_output],
+        queue=True
     )
     
     # Also allow Enter key to submit
     question_input.submit(
         process_query,
         inputs=[question_input],
-        outputs=[answer_output, sql_output, raw_output]
+        outputs=[answer_output, sql_output, raw_output, rows_output],
+        queue=True
     )
 
+# Queue requests so concurrent users run on separate workers
+demo.queue(max_size=32, default_concurrency_limit=8)
+
 if __name__ == "__main__":
+    # Warm the sample-question SQL before serving so the first click is fast
+    try:
+        get_sample_sql()
+    except Exception as e:
+        print(f"Could not prepare sample questions: {e}")
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
-        share=True  # Set to True if you want to create a public link
+        share=os.getenv("GRADIO_SHARE", "0") == "1"  # Set GRADIO_SHARE=1 to create a public link
     )
\ No newline at end of file